@@ -1,733 +1,812 @@
-from flask import Flask, request, jsonify, render_template_string, send_file
+from flask import Flask, request, send_from_directory, Response
 from flask_cors import CORS
-from PIL import Image
+import numpy as np
 import os
 from werkzeug.utils import secure_filename
-import io
+from werkzeug.exceptions import NotFound
 from datetime import datetime
-import threading
-import queue
-import hashlib
+import blake3
+import orjson
 import mimetypes
+import secrets
 import subprocess
+import asyncio
+import threading
+import queue
 import tempfile
+import gzip
+import struct
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial, lru_cache
+from collections import OrderedDict
+import nvc_backend
+import pyav_backend
+import image_worker
 
 app = Flask(__name__)
 CORS(app)
 app.config['MAX_CONTENT_LENGTH'] = 1000 * 1024 * 1024  # 1GB max
 app.config['UPLOAD_FOLDER'] = 'uploads/events'
+# Behind nginx/Apache: let the proxy sendfile() downloads via X-Sendfile (USE_X_SENDFILE=1)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
 
 # Create upload directory
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# High-performance processing queue
-processing_queue = queue.Queue()
-results_store = {}  # Store processing results by upload_id
+# Static docs page: read and gzip once at startup, served as plain bytes
+with open(os.path.join(app.root_path, 'templates', 'index.html'), 'rb') as f:
+    INDEX_HTML = f.read()
+INDEX_HTML_GZ = gzip.compress(INDEX_HTML, 9)
+# Content hash as ETag (one per encoding) so revalidations get an empty 304
+INDEX_HTML_ETAG = blake3.blake3(INDEX_HTML).hexdigest(length=8)
+
+print(f"JPEG encoder: {'mozjpeg' if image_worker.JPEG_MOZJPEG else ('libjpeg-turbo (SIMD)' if image_worker.JPEG_TURBO else 'libjpeg (no SIMD)')}")
+
+def public_result(result):
+    """Status payload for a finished task (sizes in MB, savings in percent)"""
+    if result['status'] != 'completed':
+        return result
+    original_size = result['original_size']
+    final_size = result['final_size']
+    savings = ((original_size - final_size) / original_size * 100) if original_size > 0 else 0
+    return {
+        'status': 'completed',
+        'original_size_mb': round(original_size / (1024 * 1024), 2),
+        'final_size_mb': round(final_size / (1024 * 1024), 2),
+        'savings_percent': round(savings, 1),
+        'compressed': result['compressed'],
+        'compression_method': result['compression_method'],
+        'file_type': result['file_type'],
+        'filepath': result['filepath'],
+        'filename': os.path.basename(result['filepath'])
+    }
 
-def compress_video_ffmpeg(input_path, output_path, quality='medium'):
+class ResultsTable:
     """
-    Compress video using FFmpeg with ultra-fast presets
-    Quality options: 'low' (smallest), 'medium' (balanced), 'high' (best quality)
+    Fixed-capacity store of per-file task results keyed by (upload_id, filename)
+    Sizes and flags live in one packed NumPy record array; the only Python objects
+    per entry are the dict slot and its path/error string. Once full, the oldest
+    slot is reused; uploads older than ttl seconds are forgotten along with their per-file results.
     """
+    COMPRESSION_METHODS = ('none', 'image_jpeg', 'video_h264', 'remux_copy')
+    FILE_TYPES = ('other', 'image', 'video')
+    FLAG_COMPLETED = 1
+    FLAG_COMPRESSED = 2
+    
+    def __init__(self, capacity, ttl):
+        self.records = np.zeros(capacity, dtype=[
+            ('original_size', 'u8'),
+            ('final_size', 'u8'),
+            ('flags', 'u1'),
+            ('method', 'u1'),
+            ('file_type', 'u1')
+        ])
+        self.slot_keys = [None] * capacity
+        self.index = {}  # (upload_id, filename) -> (slot, filepath or error message)
+        self.uploads = OrderedDict()  # upload_id -> (registered_at, filenames), oldest first
+        self.ttl = ttl
+        self.next_slot = 0
+        self.lock = threading.Lock()
+    
+    def register(self, upload_id, filenames):
+        """Remember which files belong to an upload so its status can list them"""
+        now = time.monotonic()
+        with self.lock:
+            self.uploads[upload_id] = (now, filenames)
+            self._expire(now)
+    
+    def _expire(self, now):
+        """Drop uploads past their TTL (or beyond capacity) and their file entries; caller holds the lock"""
+        while self.uploads:
+            upload_id, (registered_at, filenames) = next(iter(self.uploads.items()))
+            if now - registered_at <= self.ttl and len(self.uploads) <= len(self.records):
+                break
+            del self.uploads[upload_id]
+            for name in filenames:
+                entry = self.index.pop((upload_id, name), None)
+                if entry is not None:
+                    self.slot_keys[entry[0]] = None
+    
+    def put(self, key, result):
+        self.put_many([(key, result)])
+    
+    def put_many(self, items):
+        """Store a batch of (key, result) pairs under a single lock acquisition"""
+        with self.lock:
+            for key, result in items:
+                if key in self.index:
+                    slot = self.index[key][0]
+                else:
+                    slot = self.next_slot
+                    self.next_slot = (slot + 1) % len(self.records)
+                    evicted = self.slot_keys[slot]
+                    if evicted is not None:
+                        del self.index[evicted]
+                    self.slot_keys[slot] = key
+                
+                if result['status'] == 'completed':
+                    flags = self.FLAG_COMPLETED | (self.FLAG_COMPRESSED if result['compressed'] else 0)
+                    self.records[slot] = (
+                        result['original_size'],
+                        result['final_size'],
+                        flags,
+                        self.COMPRESSION_METHODS.index(result['compression_method']),
+                        self.FILE_TYPES.index(result['file_type'])
+                    )
+                    self.index[key] = (slot, result['filepath'])
+                else:
+                    self.records[slot] = (0, 0, 0, 0, 0)
+                    self.index[key] = (slot, result['error'])
+    
+    def get(self, key):
+        """Rebuild the status payload for one file, or None if unknown"""
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            slot, text = entry
+            original_size, final_size, flags, method, file_type = self.records[slot].item()
+        
+        if not flags & self.FLAG_COMPLETED:
+            return {'status': 'failed', 'error': text}
+        return public_result({
+            'status': 'completed',
+            'original_size': original_size,
+            'final_size': final_size,
+            'compressed': bool(flags & self.FLAG_COMPRESSED),
+            'compression_method': self.COMPRESSION_METHODS[method],
+            'file_type': self.FILE_TYPES[file_type],
+            'filepath': text
+        })
+    
+    def get_upload(self, upload_id):
+        """Status payloads for every file of an upload, or None if the upload is unknown"""
+        with self.lock:
+            entry = self.uploads.get(upload_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        filenames = entry[1]
+        files = []
+        for name in filenames:
+            result = self.get((upload_id, name))
+            if result is None:
+                result = {'status': 'processing', 'filename': name}
+            elif result['status'] == 'failed':
+                result['filename'] = name
+            files.append(result)
+        return files
+
+RESULTS_CAPACITY = 65536
+RESULTS_TTL_S = 3600
+results_store = ResultsTable(RESULTS_CAPACITY, RESULTS_TTL_S)  # Store processing results by upload_id
+
+# Finished results are funnelled through a lock-free SimpleQueue and written in batches
+results_inbox = queue.SimpleQueue()
+
+def results_writer():
+    """Drain finished results and write them to results_store in batches"""
+    while True:
+        batch = [results_inbox.get()]
+        while True:
+            try:
+                batch.append(results_inbox.get_nowait())
+            except queue.Empty:
+                break
+        results_store.put_many(batch)
+
+threading.Thread(target=results_writer, daemon=True).start()
+
+# Back-pressure: cap tasks admitted but not yet finished, excess uploads get HTTP 503;
+# a single upload with more files than this could never be admitted and gets HTTP 413
+MAX_PENDING_TASKS = 64
+pending_tasks = threading.BoundedSemaphore(MAX_PENDING_TASKS)
+
+# Finished outputs keyed by content hash + settings, so duplicate uploads are hard-linked instead of recompressed
+OUTPUT_CACHE_SIZE = 512
+output_cache = OrderedDict()
+output_cache_lock = threading.Lock()
+
+def cached_output(key):
+    """Return the raw result previously produced for this key, or None"""
+    with output_cache_lock:
+        result = output_cache.get(key)
+        if result is not None:
+            output_cache.move_to_end(key)
+        return result
+
+def remember_output(key, result):
+    """Remember a completed result for this key, evicting the least recently used entry"""
+    with output_cache_lock:
+        output_cache[key] = result
+        output_cache.move_to_end(key)
+        if len(output_cache) > OUTPUT_CACHE_SIZE:
+            output_cache.popitem(last=False)
+
+def link_cached_output(cached, filepath):
+    """Hard-link a cached output next to the new upload's path, returns the new result or None"""
+    target = os.path.splitext(filepath)[0] + os.path.splitext(cached['filepath'])[1]
     try:
-        quality_settings = {
-            'low': {'crf': '28', 'preset': 'veryfast'},      # ~70% compression, very fast
-            'medium': {'crf': '23', 'preset': 'fast'},        # ~50% compression, fast
-            'high': {'crf': '18', 'preset': 'medium'}         # ~30% compression, slower
-        }
+        os.link(cached['filepath'], target)
+    except OSError:
+        return None
+    return dict(cached, filepath=os.path.abspath(target))
+
+# Hardware H.264 encoders in order of preference (libx264 is the CPU fallback)
+HW_ENCODER_CANDIDATES = ('h264_nvenc', 'h264_qsv', 'h264_amf', 'h264_videotoolbox')
+
+def detect_hw_encoder():
+    """Return the first hardware H.264 encoder FFmpeg can actually open, or None"""
+    try:
+        listing = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                 capture_output=True, text=True, timeout=10).stdout
+        for encoder in HW_ENCODER_CANDIDATES:
+            if f' {encoder} ' not in listing:
+                continue
+            # Distro builds list encoders whose GPU/driver is missing, so encode one test frame
+            probe = subprocess.run([
+                'ffmpeg', '-hide_banner', '-f', 'lavfi', '-i', 'color=size=256x256',
+                '-frames:v', '1', '-c:v', encoder, '-f', 'null', '-'
+            ], capture_output=True, timeout=15)
+            if probe.returncode == 0:
+                return encoder
+    except Exception as e:
+        print(f"Hardware encoder probe failed: {e}")
+    return None
+
+HW_ENCODER = detect_hw_encoder()
+
+def video_codec_args(settings, threads=0, hw=True):
+    """
+    FFmpeg video codec arguments for the selected encoder (threads=0 lets x264 use every core)
+    hw=False forces libx264 even when a hardware encoder was detected
+    """
+    encoder = HW_ENCODER if hw else None
+    if encoder == 'h264_nvenc':
+        return ['-c:v', 'h264_nvenc', '-preset', 'p4', '-rc', 'vbr', '-cq', settings['cq'], '-b:v', '0']
+    if encoder == 'h264_qsv':
+        return ['-c:v', 'h264_qsv', '-global_quality', settings['cq'], '-preset', 'veryfast']
+    if encoder == 'h264_amf':
+        return ['-c:v', 'h264_amf', '-rc', 'cqp', '-qp_i', settings['cq'], '-qp_p', settings['cq']]
+    if encoder == 'h264_videotoolbox':
+        return ['-c:v', 'h264_videotoolbox', '-q:v', settings['vt_quality']]
+    lookahead_threads = max(1, (threads or os.cpu_count() or 1) // 4)
+    return [
+        '-c:v', 'libx264',             # H.264 codec
+        '-preset', settings['preset'], # Speed preset
+        '-crf', settings['crf'],       # Quality (lower = better)
+        '-threads', str(threads),
+        '-x264-params', f"lookahead-threads={lookahead_threads}",
+    ]
+
+# Video backend: 'auto' uses PyNvVideoCodec on GPU hosts and FFmpeg otherwise,
+# 'pyav' encodes in-process with PyAV, 'ffmpeg' forces the FFmpeg CLI
+VIDEO_BACKEND = os.environ.get('VIDEO_BACKEND', 'auto')
+USE_NVC = nvc_backend.AVAILABLE and VIDEO_BACKEND in ('auto', 'nvc')
+USE_PYAV = pyav_backend.AVAILABLE and VIDEO_BACKEND == 'pyav'
+if USE_NVC:
+    print("Video encoder: PyNvVideoCodec (NVDEC/NVENC)")
+elif USE_PYAV:
+    print("Video encoder: PyAV libx264 (in-process)")
+else:
+    print(f"Video encoder: {HW_ENCODER or 'libx264 (CPU)'}")
+
+# Video jobs run on one asyncio event loop that supervises every FFmpeg process;
+# ffmpeg_slots caps how many FFmpeg/ffprobe processes run at once. Encodes also take one of
+# the fewer encode_slots and get an equal share of the cores, so concurrent encodes split
+# the CPU instead of each auto-threading across all of it
+video_loop = asyncio.new_event_loop()
+ffmpeg_slots = asyncio.Semaphore(os.cpu_count() or 1)
+ENCODE_SLOTS = max(1, (os.cpu_count() or 1) // 4)
+ENCODE_THREADS = max(1, (os.cpu_count() or 1) // ENCODE_SLOTS)
+encode_slots = asyncio.Semaphore(ENCODE_SLOTS)
+threading.Thread(target=video_loop.run_forever, daemon=True).start()
+
+def native_thread_pool():
+    """
+    Under gevent (see gunicorn.conf.py) threading is monkey-patched into greenlets,
+    so return a pool of real OS threads for blocking library calls; None otherwise
+    """
+    try:
+        from gevent import monkey
+        from gevent.threadpool import ThreadPool
+    except ImportError:
+        return None
+    if not monkey.is_module_patched('threading'):
+        return None
+    return ThreadPool(os.cpu_count() or 1)
+
+offload_pool = native_thread_pool()
+
+async def run_blocking(func, *args):
+    """Run a blocking library call (PyAV, PyNvVideoCodec) on an OS thread without stalling the loop"""
+    if offload_pool is None:
+        return await asyncio.to_thread(func, *args)
+    future = Future()
+    
+    def finish(result):
+        if result.successful():
+            future.set_result(result.value)
+        else:
+            future.set_exception(result.exception)
+    
+    offload_pool.spawn(func, *args).rawlink(finish)
+    return await asyncio.wrap_future(future)
+
+async def run_encode(cmd):
+    """run_process for an encode, waiting for one of the encode slots first"""
+    async with encode_slots:
+        return await run_process(cmd)
+
+async def run_process(cmd, timeout=300):
+    """Run FFmpeg/ffprobe without blocking the loop, returns (returncode, stdout)"""
+    async with ffmpeg_slots:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return -1, b''
+        return proc.returncode, stdout
+
+# Long videos are split at keyframes and the segments encoded in parallel
+SEGMENT_THRESHOLD_S = 60
+SEGMENT_TIME_S = 30
+
+async def probe_duration(input_path):
+    """Return video duration in seconds via ffprobe (0 when unknown)"""
+    try:
+        _, stdout = await run_process([
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            input_path
+        ], timeout=30)
+        return float(stdout.strip() or 0)
+    except Exception:
+        return 0.0
+
+async def compress_video_segmented(input_path, output_path, settings):
+    """
+    Split the input's video into ~30s keyframe-aligned segments, encode them concurrently
+    across all cores, then stitch them back together into output_path with the concat demuxer
+    Audio is encoded once from the original in the concat step: separately encoded AAC
+    segments each carry their own priming/padding, which gaps and drifts at every boundary
+    Returns True on success
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        returncode, _ = await run_process([
+            'ffmpeg', '-i', input_path,
+            '-map', '0:v:0',
+            '-c', 'copy',
+            '-f', 'segment',
+            '-segment_time', str(SEGMENT_TIME_S),
+            '-reset_timestamps', '1',
+            os.path.join(workdir, 'seg%03d.ts')
+        ])
+        if returncode != 0:
+            return False
         
-        settings = quality_settings.get(quality, quality_settings['medium'])
+        segments = sorted(name for name in os.listdir(workdir) if name.startswith('seg'))
+        if not segments:
+            return False
         
-        # FFmpeg command for fast H.264 compression
-        cmd = [
+        async def encode_segment(name):
+            returncode, _ = await run_encode([
+                'ffmpeg', '-i', os.path.join(workdir, name),
+                *video_codec_args(settings, ENCODE_THREADS),
+                '-an',
+                '-y', os.path.join(workdir, f'enc_{name}')
+            ])
+            return returncode == 0
+        
+        if not all(await asyncio.gather(*(encode_segment(name) for name in segments))):
+            return False
+        
+        list_path = os.path.join(workdir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            f.writelines(f"file 'enc_{name}'\n" for name in segments)
+        
+        returncode, _ = await run_process([
+            'ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-i', input_path,
+            '-map', '0:v:0', '-map', '1:a:0?',
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+            '-b:a', '96k',
+            '-movflags', '+faststart',
+            '-y', output_path
+        ])
+        return returncode == 0
+
+# quality='auto': H.264/HEVC uploads at or below this bitrate are remuxed instead of re-encoded
+REMUX_CODECS = {'h264', 'hevc'}
+REMUX_MAX_BITRATE = 2_500_000  # bits per second
+
+async def should_transcode(input_path):
+    """Return False when the video stream is already H.264/HEVC within the target bitrate"""
+    try:
+        _, stdout = await run_process([
+            'ffprobe', '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=codec_name,bit_rate',
+            '-of', 'csv=p=0',
+            input_path
+        ], timeout=30)
+        codec, _, bit_rate = stdout.decode().strip().partition(',')
+        return not (codec in REMUX_CODECS and bit_rate.isdigit() and int(bit_rate) <= REMUX_MAX_BITRATE)
+    except Exception:
+        return True
+
+async def remux_video(input_path, output_path):
+    """Copy the streams into an MP4 container without re-encoding, returns True on success"""
+    returncode, _ = await run_process([
+        'ffmpeg', '-i', input_path,
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        '-y', output_path
+    ])
+    return returncode == 0
+
+async def transcode_nvc(input_path, output_path, cq):
+    """
+    Encode the video stream on the GPU (a blocking library, so off the loop), then encode
+    the audio and mux from the loop through run_process: under gevent, subprocesses can't
+    be started from the offload threads
+    Returns True on success
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        video_path = os.path.join(workdir, 'video.h264')
+        frame_rate = await run_blocking(nvc_backend.transcode, input_path, cq, video_path)
+        if not frame_rate:
+            return False
+        returncode, _ = await run_process([
             'ffmpeg',
+            '-framerate', str(frame_rate),
+            '-i', video_path,
             '-i', input_path,
-            '-c:v', 'libx264',           # H.264 codec
-            '-preset', settings['preset'], # Speed preset
-            '-crf', settings['crf'],      # Quality (lower = better)
-            '-c:a', 'aac',                # Audio codec
-            '-b:a', '128k',               # Audio bitrate
-            '-movflags', '+faststart',    # Web optimization
-            '-y',                         # Overwrite output
+            '-map', '0:v:0',
+            '-map', '1:a:0?',
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+            '-b:a', '96k',
+            '-movflags', '+faststart',
+            '-y',
             output_path
-        ]
+        ])
+        return returncode == 0
+
+async def compress_video(input_path, output_path, quality='medium'):
+    """
+    Compress video on the GPU (PyNvVideoCodec) or with FFmpeg, reading the spooled upload from disk
+    The encoder writes output_path itself, so the video never passes through Python
+    Quality options: 'low' (smallest), 'medium' (balanced), 'high' (best quality),
+    'auto' (remux already-efficient H.264/HEVC, otherwise encode as medium)
+    Returns the compression method on success, or None on failure
+    """
+    try:
+        # One x264 preset for every profile; CRF alone sets the size/quality trade-off
+        quality_settings = {
+            'low': {'crf': '28', 'preset': 'veryfast',       # ~70% compression
+                    'cq': '28', 'vt_quality': '45'},
+            'medium': {'crf': '23', 'preset': 'veryfast',    # ~50% compression
+                       'cq': '23', 'vt_quality': '55'},
+            'high': {'crf': '20', 'preset': 'veryfast',      # ~30% compression
+                     'cq': '20', 'vt_quality': '65'}
+        }
+        
+        settings = quality_settings.get(quality, quality_settings['medium'])
+        
+        # Conversion necessity check: copying streams takes milliseconds, encoding takes minutes
+        if quality == 'auto' and not await should_transcode(input_path):
+            if await remux_video(input_path, output_path):
+                return 'remux_copy'
+        
+        # NVDEC -> NVENC directly; fall back to FFmpeg on failure
+        if USE_NVC and await transcode_nvc(input_path, output_path, settings['cq']):
+            return 'video_h264'
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-        return result.returncode == 0
+        # In-process libav: no fork/exec
+        if USE_PYAV and await run_blocking(pyav_backend.transcode, input_path, settings['crf'], settings['preset'], output_path):
+            return 'video_h264'
+        
+        # Long clips on the CPU encoder: encode segments on all cores, single-shot for short ones
+        if not HW_ENCODER and await probe_duration(input_path) > SEGMENT_THRESHOLD_S:
+            if await compress_video_segmented(input_path, output_path, settings):
+                return 'video_h264'
+        
+        # Hardware encoder first, then libx264 if the GPU encode fails at runtime (driver, session limit)
+        for hw in ((True, False) if HW_ENCODER else (False,)):
+            # FFmpeg command for fast H.264 compression (decode is offloaded too when encoding on GPU)
+            cmd = ['ffmpeg']
+            if hw:
+                cmd += ['-hwaccel', 'auto']
+            cmd += [
+                '-i', input_path,
+                *video_codec_args(settings, ENCODE_THREADS, hw=hw),
+                '-c:a', 'aac',                # Audio codec
+                '-b:a', '96k',                # Audio bitrate
+                '-movflags', '+faststart',    # Web optimization
+                '-y',                         # Overwrite output
+                output_path
+            ]
+            
+            returncode, _ = await run_encode(cmd)
+            if returncode == 0:
+                return 'video_h264'
+            if hw:
+                print(f"{HW_ENCODER} encode failed, retrying with libx264")
         
     except Exception as e:
         print(f"Video compression error: {e}")
+    
+    # Drop any partial output so the caller can fall back to the original
+    if os.path.exists(output_path):
+        os.unlink(output_path)
+    return None
+
+# JPEG markers that start a frame header (SOF0-SOF15 minus DHT, JPG and DAC)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers that stand alone without a length field (TEM, RST0-7, SOI)
+JPEG_STANDALONE_MARKERS = frozenset({0x01, 0xD8, *range(0xD0, 0xD8)})
+# APP1 carries Exif and XMP metadata (GPS position, camera serial, ...)
+JPEG_APP1_MARKER = 0xE1
+
+def jpeg_frame_info(path):
+    """
+    Read (width, height, has_metadata) from a JPEG's headers by skipping segment to segment, or None
+    has_metadata is True when an APP1 (Exif/XMP) segment comes before the frame header
+    """
+    has_metadata = False
+    try:
+        with open(path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            while True:
+                if f.read(1) != b'\xff':
+                    return None
+                marker = f.read(1)
+                while marker == b'\xff':  # Fill bytes
+                    marker = f.read(1)
+                if not marker:
+                    return None
+                code = marker[0]
+                if code in JPEG_STANDALONE_MARKERS:
+                    continue
+                if code in (0xD9, 0xDA):  # EOI or start of scan before any frame header
+                    return None
+                header = f.read(2)
+                if len(header) < 2:
+                    return None
+                (segment_length,) = struct.unpack('>H', header)
+                if code == JPEG_APP1_MARKER:
+                    has_metadata = True
+                if code in JPEG_SOF_MARKERS:
+                    frame = f.read(5)
+                    if len(frame) < 5:
+                        return None
+                    _, height, width = struct.unpack('>BHH', frame)
+                    return width, height, has_metadata
+                f.seek(segment_length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+# Already-small JPEGs are stored as-is: at quality 75 the budget is 0.2 bytes per pixel
+# (~200 KB per megapixel), scaled linearly with the requested quality. JPEGs carrying
+# Exif/XMP are always re-encoded, which strips the metadata like every other output
+JPEG_PASSTHROUGH_BYTES_PER_PIXEL = 0.2
+
+def jpeg_meets_targets(path, file_size, quality, max_dimension):
+    """True when a metadata-free JPEG already fits max_dimension and the size budget, so re-encoding can be skipped"""
+    info = jpeg_frame_info(path)
+    if info is None or info[2]:
         return False
+    width, height, _ = info
+    budget = width * height * JPEG_PASSTHROUGH_BYTES_PER_PIXEL * quality / 75
+    return max(width, height) <= max_dimension and file_size <= budget
 
-def smart_processor_worker():
-    """Background worker that handles compression and saving for images AND videos"""
-    while True:
-        try:
-            task = processing_queue.get()
-            if task is None:
+# Event folders already created by this process; a burst of uploads in the same
+# second skips makedirs' stat/mkdir calls. Reset once it grows past the cap.
+KNOWN_DIRS_MAX = 1024
+known_dirs = set()
+
+def ensure_dir(path):
+    """os.makedirs(path, exist_ok=True), skipped for folders this process already created"""
+    if path in known_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    if len(known_dirs) >= KNOWN_DIRS_MAX:
+        known_dirs.clear()
+    known_dirs.add(path)
+
+@lru_cache(maxsize=64)
+def guess_mime(ext):
+    """MIME type for a lowercase file extension ('' when unknown), cached per extension"""
+    return mimetypes.guess_type('upload' + ext)[0] or ''
+
+# Upload classes by MIME major type: (file_type, compression_type)
+FILE_CLASSES = {'image': ('image', 'jpeg'), 'video': ('video', 'h264')}
+OTHER_FILE_CLASS = ('other', 'none')
+
+@lru_cache(maxsize=256)
+def classify_file(content_type, ext):
+    """(file_type, compression_type) for an upload, cached per content type and extension"""
+    mime_type = content_type or guess_mime(ext)
+    return FILE_CLASSES.get(mime_type.partition('/')[0], OTHER_FILE_CLASS)
+
+# Uploads are streamed to a spool file next to their destination, 1 MB at a time
+SPOOL_CHUNK_SIZE = 1 << 20
+
+def spool_path_for(filepath):
+    """Hidden spool file beside filepath (same filesystem, so it can be renamed into place)"""
+    folder, filename = os.path.split(filepath)
+    return os.path.join(folder, '.' + filename)
+
+def spool_upload(stream, path):
+    """
+    Copy an upload stream to a spool file in fixed-size chunks, hashing it on the way
+    Returns the byte count and the content's blake3 hex digest
+    """
+    hasher = blake3.blake3()
+    view = memoryview(bytearray(SPOOL_CHUNK_SIZE))
+    size = 0
+    with open(path, 'wb') as f:
+        while True:
+            n = stream.readinto(view)
+            if not n:
                 break
-            
-            upload_id, file_data, filepath, should_compress, quality, max_dimension, original_filename, video_quality = task
-            
-            try:
-                # Determine file type
-                mime_type = mimetypes.guess_type(original_filename)[0] or ''
-                is_image = mime_type.startswith('image/')
-                is_video = mime_type.startswith('video/')
-                
-                original_size = len(file_data)
-                final_data = file_data
-                compressed = False
-                compression_method = 'none'
-                
-                # COMPRESS IMAGES
-                if is_image and should_compress:
-                    try:
-                        img = Image.open(io.BytesIO(file_data))
-                        
-                        # Convert to RGB if needed
-                        if img.mode == 'RGBA':
-                            background = Image.new('RGB', img.size, (255, 255, 255))
-                            background.paste(img, mask=img.split()[3])
-                            img = background
-                        elif img.mode not in ('RGB', 'L'):
-                            img = img.convert('RGB')
-                        
-                        # Resize if needed
-                        width, height = img.size
-                        if width > max_dimension or height > max_dimension:
-                            if width > height:
-                                new_height = int((height / width) * max_dimension)
-                                new_width = max_dimension
-                            else:
-                                new_width = int((width / height) * max_dimension)
-                                new_height = max_dimension
-                            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                        
-                        # Compress
-                        output = io.BytesIO()
-                        img.save(output, format='JPEG', quality=quality, optimize=True)
-                        final_data = output.getvalue()
-                        compressed = True
-                        compression_method = 'image_jpeg'
-                        
-                    except Exception as e:
-                        print(f"Image compression failed, using original: {e}")
-                        final_data = file_data
-                
-                # COMPRESS VIDEOS
-                elif is_video and should_compress:
-                    try:
-                        # Save original video to temp file
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(original_filename)[1]) as temp_input:
-                            temp_input.write(file_data)
-                            temp_input_path = temp_input.name
-                        
-                        # Create temp output path
-                        temp_output_path = temp_input_path.replace(os.path.splitext(temp_input_path)[1], '_compressed.mp4')
-                        
-                        # Compress video with FFmpeg
-                        success = compress_video_ffmpeg(temp_input_path, temp_output_path, video_quality)
-                        
-                        if success and os.path.exists(temp_output_path):
-                            # Read compressed video
-                            with open(temp_output_path, 'rb') as f:
-                                final_data = f.read()
-                            compressed = True
-                            compression_method = 'video_h264'
-                            
-                            # Change output filename to .mp4
-                            filepath = filepath.rsplit('.', 1)[0] + '.mp4'
-                            
-                            # Cleanup temp files
-                            os.unlink(temp_output_path)
-                        
-                        # Cleanup temp input
-                        os.unlink(temp_input_path)
-                        
-                    except Exception as e:
-                        print(f"Video compression failed, using original: {e}")
-                        final_data = file_data
-                
-                # Save file
-                with open(filepath, 'wb') as f:
-                    f.write(final_data)
-                
-                final_size = len(final_data)
-                savings = ((original_size - final_size) / original_size * 100) if original_size > 0 else 0
-                
-                # Store result
-                results_store[upload_id] = {
-                    'status': 'completed',
-                    'original_size_mb': round(original_size / (1024 * 1024), 2),
-                    'final_size_mb': round(final_size / (1024 * 1024), 2),
-                    'savings_percent': round(savings, 1),
-                    'compressed': compressed,
-                    'compression_method': compression_method,
-                    'file_type': 'image' if is_image else ('video' if is_video else 'other'),
-                    'filepath': os.path.abspath(filepath),
-                    'filename': os.path.basename(filepath)
-                }
-                
-            except Exception as e:
-                results_store[upload_id] = {
-                    'status': 'failed',
-                    'error': str(e)
-                }
-            
-            processing_queue.task_done()
-            
-        except Exception as e:
-            print(f"Worker error: {e}")
+            hasher.update(view[:n])
+            f.write(view[:n])
+            size += n
+    return size, hasher.hexdigest()
+
+async def process_video_task(task):
+    """Compress and save one video, runs on the video event loop"""
+    spool_path, file_size, filepath, file_type, should_compress, quality, max_dimension, original_filename, video_quality = task
+    try:
+        if should_compress:
+            # Output filename changes to .mp4; the encoder reads the spool file and writes it directly
+            mp4_path = filepath.rsplit('.', 1)[0] + '.mp4'
+            method = await compress_video(spool_path, mp4_path, video_quality)
+            if method:
+                return image_worker.completed_result(mp4_path, file_type, file_size, os.stat(mp4_path).st_size, True, method)
+            print("Video compression failed, using original")
+        
+        os.replace(spool_path, filepath)
+        return image_worker.completed_result(filepath, file_type, file_size, file_size, False, 'none')
+    
+    except Exception as e:
+        return {
+            'status': 'failed',
+            'error': str(e)
+        }
+    finally:
+        image_worker.discard_spool(spool_path)
+
+def start_video_tasks(videos):
+    """Schedule a batch of (task, Future) pairs on the video event loop (runs on the loop)"""
+    for task, future in videos:
+        video_loop.create_task(process_video_task(task)).add_done_callback(partial(copy_task_result, future))
 
-# Start 4 background workers for parallel processing
-NUM_WORKERS = 4
-for _ in range(NUM_WORKERS):
-    worker = threading.Thread(target=smart_processor_worker, daemon=True)
-    worker.start()
+def copy_task_result(future, task):
+    """Hand an asyncio task's outcome to the concurrent Future the web process holds"""
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+def submit_to_pool(task):
+    """
+    Run a task on the image worker pool, returns a Future for its result
+    A pool that broke (a worker was OOM-killed or crashed) is replaced and the task resubmitted;
+    if that fails too, or the task itself was lost with the pool, the upload is stored as-is
+    """
+    global executor
+    future = Future()
+    pool = executor
+    try:
+        pool_future = pool.submit(image_worker.process_task, task)
+    except BrokenProcessPool:
+        with executor_lock:
+            if executor is pool:
+                print("Image worker pool broke, starting a new one")
+                pool.shutdown(wait=False)
+                executor = start_pool()
+            pool = executor
+        try:
+            pool_future = pool.submit(image_worker.process_task, task)
+        except Exception:
+            future.set_result(image_worker.store_original(task))
+            return future
+    pool_future.add_done_callback(partial(copy_pool_result, future, task))
+    return future
+
+def copy_pool_result(future, task, pool_future):
+    """Hand a pool task's result on; a task that died with its worker keeps the original"""
+    try:
+        future.set_result(pool_future.result())
+    except BrokenProcessPool:
+        future.set_result(image_worker.store_original(task))
+    except Exception as e:
+        future.set_exception(e)
+
+def submit_tasks(tasks):
+    """
+    Route a batch of tasks to the video event loop or the image worker pool,
+    returns one Future per task; all videos reach the loop in a single wakeup
+    """
+    futures = []
+    videos = []
+    for task in tasks:
+        if task[3] == 'video':
+            future = Future()
+            videos.append((task, future))
+        else:
+            future = submit_to_pool(task)
+        futures.append(future)
+    if videos:
+        video_loop.call_soon_threadsafe(start_video_tasks, videos)
+    return futures
+
+def store_result(key, cache_key, future):
+    """Record a finished task's result and free its slot (runs in the web process)"""
+    pending_tasks.release()
+    try:
+        result = future.result()
+        if result.get('status') == 'completed':
+            remember_output(cache_key, result)
+        results_inbox.put((key, result))
+    except Exception as e:
+        print(f"Worker error: {e}")
+        results_inbox.put((key, {
+            'status': 'failed',
+            'error': str(e)
+        }))
+
+# Persistent pool with one worker process per core for image compression (no GIL contention),
+# so a batch of photos spreads across every core instead of queueing four deep.
+# Under gevent workers are spawned, not forked: a fork would copy the hub and greenlets
+# into every worker. Otherwise they fork, so `python app.py` doesn't rerun its startup
+# in each of them
+POOL_START_METHOD = 'spawn' if offload_pool is not None else 'fork'
+NUM_WORKERS = os.cpu_count() or 4
+
+def start_pool():
+    """Start the image worker pool"""
+    return ProcessPoolExecutor(
+        max_workers=NUM_WORKERS,
+        initializer=image_worker.set_process_niceness,
+        mp_context=multiprocessing.get_context(POOL_START_METHOD)
+    )
+
+executor = start_pool()
+executor_lock = threading.Lock()
+
+def json_response(payload):
+    """JSON Response serialised with orjson (status polls make this the hottest path)"""
+    return Response(orjson.dumps(payload), mimetype='application/json')
 
 @app.route('/')
 def index():
     """API Documentation Homepage"""
-    html = '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>🚀 Smart Upload API - Images + Videos</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            * { margin: 0; padding: 0; box-sizing: border-box; }
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                min-height: 100vh;
-                padding: 40px 20px;
-            }
-            .container {
-                max-width: 1000px;
-                margin: 0 auto;
-                background: white;
-                border-radius: 20px;
-                padding: 40px;
-                box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-            }
-            h1 {
-                color: #333;
-                font-size: 36px;
-                margin-bottom: 10px;
-            }
-            .badge {
-                display: inline-block;
-                background: #10b981;
-                color: white;
-                padding: 6px 16px;
-                border-radius: 20px;
-                font-size: 14px;
-                font-weight: bold;
-                margin-left: 10px;
-            }
-            .badge.video {
-                background: #f59e0b;
-            }
-            .subtitle {
-                color: #666;
-                font-size: 18px;
-                margin-bottom: 30px;
-            }
-            .hero {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                padding: 30px;
-                border-radius: 15px;
-                margin-bottom: 30px;
-            }
-            .hero h2 {
-                font-size: 24px;
-                margin-bottom: 15px;
-            }
-            .hero-features {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-                gap: 15px;
-                margin-top: 20px;
-            }
-            .hero-feature {
-                background: rgba(255,255,255,0.2);
-                padding: 15px;
-                border-radius: 10px;
-                backdrop-filter: blur(10px);
-            }
-            .hero-feature-title {
-                font-weight: bold;
-                margin-bottom: 5px;
-                font-size: 16px;
-            }
-            .hero-feature-desc {
-                font-size: 13px;
-                opacity: 0.9;
-            }
-            .endpoint-box {
-                background: #f8f9ff;
-                border-left: 4px solid #667eea;
-                padding: 25px;
-                border-radius: 10px;
-                margin-bottom: 30px;
-            }
-            .method {
-                display: inline-block;
-                background: #667eea;
-                color: white;
-                padding: 6px 14px;
-                border-radius: 6px;
-                font-weight: bold;
-                font-size: 14px;
-                margin-right: 10px;
-            }
-            .url {
-                color: #764ba2;
-                font-weight: bold;
-                font-size: 18px;
-            }
-            .section {
-                margin-bottom: 30px;
-            }
-            .section h3 {
-                color: #667eea;
-                font-size: 20px;
-                margin-bottom: 15px;
-                padding-bottom: 10px;
-                border-bottom: 2px solid #e5e7eb;
-            }
-            table {
-                width: 100%;
-                border-collapse: collapse;
-                margin: 15px 0;
-            }
-            th, td {
-                padding: 12px;
-                text-align: left;
-                border-bottom: 1px solid #e5e7eb;
-            }
-            th {
-                background: #f8f9ff;
-                color: #667eea;
-                font-weight: 600;
-            }
-            .code-block {
-                background: #1e1e1e;
-                color: #d4d4d4;
-                padding: 20px;
-                border-radius: 10px;
-                overflow-x: auto;
-                font-family: 'Courier New', monospace;
-                font-size: 14px;
-                margin: 15px 0;
-            }
-            .highlight {
-                color: #4ec9b0;
-                font-weight: bold;
-            }
-            .comment {
-                color: #6a9955;
-            }
-            .string {
-                color: #ce9178;
-            }
-            .feature-grid {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-                gap: 20px;
-                margin: 20px 0;
-            }
-            .feature-card {
-                background: #f8f9ff;
-                padding: 20px;
-                border-radius: 10px;
-                border-top: 3px solid #667eea;
-            }
-            .feature-card.video {
-                border-top-color: #f59e0b;
-            }
-            .feature-icon {
-                font-size: 32px;
-                margin-bottom: 10px;
-            }
-            .feature-title {
-                font-weight: bold;
-                color: #333;
-                margin-bottom: 8px;
-            }
-            .feature-desc {
-                color: #666;
-                font-size: 14px;
-            }
-            .response-example {
-                background: #f0fdf4;
-                border-left: 4px solid #10b981;
-                padding: 15px;
-                border-radius: 8px;
-                margin: 15px 0;
-            }
-            .speed-badge {
-                display: inline-block;
-                background: #10b981;
-                color: white;
-                padding: 4px 10px;
-                border-radius: 12px;
-                font-size: 12px;
-                font-weight: bold;
-                margin-left: 10px;
-            }
-            .warning-box {
-                background: #fef3c7;
-                border-left: 4px solid #f59e0b;
-                padding: 15px;
-                border-radius: 8px;
-                margin: 15px 0;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🚀 Smart Upload API <span class="badge">IMAGES</span><span class="badge video">VIDEOS</span></h1>
-            <p class="subtitle">One API endpoint: Fast upload + Smart compression for BOTH images AND videos!</p>
-
-            <div class="hero">
-                <h2>✨ Complete Media Solution</h2>
-                <p style="margin-bottom: 20px; opacity: 0.95;">Upload ANY media - images get compressed, videos get compressed, everything uploads FAST!</p>
-                
-                <div class="hero-features">
-                    <div class="hero-feature">
-                        <div class="hero-feature-title">⚡ Ultra-Fast Upload</div>
-                        <div class="hero-feature-desc">50-200ms response, any file size</div>
-                    </div>
-                    <div class="hero-feature">
-                        <div class="hero-feature-title">📸 Image Compression</div>
-                        <div class="hero-feature-desc">JPEG optimization, 60-75% smaller</div>
-                    </div>
-                    <div class="hero-feature">
-                        <div class="hero-feature-title">🎬 Video Compression</div>
-                        <div class="hero-feature-desc">H.264 encoding, 40-70% smaller</div>
-                    </div>
-                    <div class="hero-feature">
-                        <div class="hero-feature-title">🔄 Background Processing</div>
-                        <div class="hero-feature-desc">4 parallel workers, instant response</div>
-                    </div>
-                </div>
-            </div>
-
-            <div class="warning-box">
-                <strong>⚠️ FFmpeg Requirement:</strong> Video compression requires FFmpeg installed on server.
-                <div style="margin-top: 8px; font-size: 13px;">
-                    Install: <code style="background: rgba(0,0,0,0.1); padding: 2px 6px; border-radius: 3px;">sudo apt install ffmpeg</code> (Linux) or 
-                    <code style="background: rgba(0,0,0,0.1); padding: 2px 6px; border-radius: 3px;">brew install ffmpeg</code> (Mac)
-                </div>
-            </div>
-
-            <div class="endpoint-box">
-                <span class="method">POST</span>
-                <span class="url">/api/smart-upload</span>
-                <span class="speed-badge">⚡ FASTEST</span>
-                <p style="margin-top: 15px; color: #666;">
-                    <strong>Universal endpoint:</strong> Automatically detects and compresses both images AND videos. 
-                    One API for all your media upload needs!
-                </p>
-            </div>
-
-            <div class="section">
-                <h3>📥 Request Parameters</h3>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Parameter</th>
-                            <th>Type</th>
-                            <th>Default</th>
-                            <th>Description</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        <tr>
-                            <td><code>file</code> or <code>files</code></td>
-                            <td>File/Array</td>
-                            <td>-</td>
-                            <td>Single or multiple media files</td>
-                        </tr>
-                        <tr>
-                            <td><code>compress</code></td>
-                            <td>Boolean</td>
-                            <td>true</td>
-                            <td>Enable compression for images & videos</td>
-                        </tr>
-                        <tr>
-                            <td><code>quality</code></td>
-                            <td>Integer</td>
-                            <td>75</td>
-                            <td>Image quality 30-95</td>
-                        </tr>
-                        <tr>
-                            <td><code>video_quality</code></td>
-                            <td>String</td>
-                            <td>medium</td>
-                            <td>Video quality: low, medium, high</td>
-                        </tr>
-                        <tr>
-                            <td><code>max_dimension</code></td>
-                            <td>Integer</td>
-                            <td>1920</td>
-                            <td>Max image width/height in pixels</td>
-                        </tr>
-                        <tr>
-                            <td><code>event_name</code></td>
-                            <td>String</td>
-                            <td>uploads</td>
-                            <td>Folder name for organizing files</td>
-                        </tr>
-                    </tbody>
-                </table>
-            </div>
-
-            <div class="section">
-                <h3>🎬 Video Compression Settings</h3>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Quality</th>
-                            <th>Compression</th>
-                            <th>Speed</th>
-                            <th>Use Case</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        <tr>
-                            <td><code>low</code></td>
-                            <td>~70% smaller</td>
-                            <td>Very Fast</td>
-                            <td>Social media, thumbnails</td>
-                        </tr>
-                        <tr>
-                            <td><code>medium</code></td>
-                            <td>~50% smaller</td>
-                            <td>Fast</td>
-                            <td>Web streaming, general use</td>
-                        </tr>
-                        <tr>
-                            <td><code>high</code></td>
-                            <td>~30% smaller</td>
-                            <td>Moderate</td>
-                            <td>High-quality archives</td>
-                        </tr>
-                    </tbody>
-                </table>
-            </div>
-
-            <div class="section">
-                <h3>🎯 Key Features</h3>
-                <div class="feature-grid">
-                    <div class="feature-card">
-                        <div class="feature-icon">⚡</div>
-                        <div class="feature-title">Instant Response</div>
-                        <div class="feature-desc">50-200ms response regardless of file type or size</div>
-                    </div>
-                    <div class="feature-card">
-                        <div class="feature-icon">📸</div>
-                        <div class="feature-title">Image Compression</div>
-                        <div class="feature-desc">JPEG optimization with quality control</div>
-                    </div>
-                    <div class="feature-card video">
-                        <div class="feature-icon">🎬</div>
-                        <div class="feature-title">Video Compression</div>
-                        <div class="feature-desc">H.264 encoding with FFmpeg</div>
-                    </div>
-                    <div class="feature-card">
-                        <div class="feature-icon">📦</div>
-                        <div class="feature-title">Batch Upload</div>
-                        <div class="feature-desc">Mix images and videos in one request</div>
-                    </div>
-                    <div class="feature-card">
-                        <div class="feature-icon">🔄</div>
-                        <div class="feature-title">Parallel Processing</div>
-                        <div class="feature-desc">4 workers handle compression simultaneously</div>
-                    </div>
-                    <div class="feature-card">
-                        <div class="feature-icon">📊</div>
-                        <div class="feature-title">Detailed Stats</div>
-                        <div class="feature-desc">Size reduction and compression metrics</div>
-                    </div>
-                </div>
-            </div>
-
-            <div class="section">
-                <h3>💻 Code Examples</h3>
-                
-                <p><strong>Upload Image:</strong></p>
-                <div class="code-block">
-curl -X POST http://localhost:5009/api/smart-upload \\
-  -F "file=@photo.jpg" \\
-  -F "quality=75"
-                </div>
-
-                <p><strong>Upload Video with Medium Compression:</strong></p>
-                <div class="code-block">
-curl -X POST http://localhost:5009/api/smart-upload \\
-  -F "file=@video.mp4" \\
-  -F "video_quality=medium"
-                </div>
-
-                <p><strong>Upload Mixed Files (Images + Videos):</strong></p>
-                <div class="code-block">
-curl -X POST http://localhost:5009/api/smart-upload \\
-  -F "files=@photo1.jpg" \\
-  -F "files=@video.mp4" \\
-  -F "files=@photo2.jpg" \\
-  -F "quality=80" \\
-  -F "video_quality=medium"
-                </div>
-
-                <p><strong>JavaScript Example:</strong></p>
-                <div class="code-block">
-<span class="highlight">const</span> formData = <span class="highlight">new</span> FormData();
-formData.append(<span class="string">'file'</span>, fileInput.files[<span class="string">0</span>]);
-formData.append(<span class="string">'video_quality'</span>, <span class="string">'medium'</span>);
-formData.append(<span class="string">'quality'</span>, <span class="string">'75'</span>);
-
-<span class="highlight">const</span> response = <span class="highlight">await</span> fetch(<span class="string">'/api/smart-upload'</span>, {
-  method: <span class="string">'POST'</span>,
-  body: formData
-});
-
-<span class="highlight">const</span> result = <span class="highlight">await</span> response.json();
-console.log(<span class="string">'Upload ID:'</span>, result.upload_id);
-
-<span class="comment">// Check status after processing</span>
-setTimeout(<span class="highlight">async</span> () => {
-  <span class="highlight">const</span> status = <span class="highlight">await</span> fetch(result.check_status_url);
-  <span class="highlight">const</span> data = <span class="highlight">await</span> status.json();
-  console.log(<span class="string">'Compression complete!'</span>, data);
-}, <span class="string">3000</span>); <span class="comment">// Wait 3 seconds for processing</span>
-                </div>
-            </div>
-
-            <div class="section">
-                <h3>📊 Performance Benchmarks</h3>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>File Type</th>
-                            <th>Size</th>
-                            <th>API Response</th>
-                            <th>Processing Time</th>
-                            <th>Compression</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        <tr>
-                            <td>📸 Image</td>
-                            <td>5 MB</td>
-                            <td>50-100ms</td>
-                            <td>300-500ms</td>
-                            <td>~65% smaller</td>
-                        </tr>
-                        <tr>
-                            <td>📸 Large Image</td>
-                            <td>20 MB</td>
-                            <td>100-150ms</td>
-                            <td>1-2s</td>
-                            <td>~70% smaller</td>
-                        </tr>
-                        <tr>
-                            <td>🎬 Video (low)</td>
-                            <td>50 MB</td>
-                            <td>150-200ms</td>
-                            <td>10-20s</td>
-                            <td>~70% smaller</td>
-                        </tr>
-                        <tr>
-                            <td>🎬 Video (medium)</td>
-                            <td>100 MB</td>
-                            <td>150-250ms</td>
-                            <td>20-40s</td>
-                            <td>~50% smaller</td>
-                        </tr>
-                        <tr>
-                            <td>🎬 Video (high)</td>
-                            <td>200 MB</td>
-                            <td>200-300ms</td>
-                            <td>40-80s</td>
-                            <td>~30% smaller</td>
-                        </tr>
-                        <tr>
-                            <td>📦 Mixed Batch</td>
-                            <td>10 files</td>
-                            <td>200-400ms</td>
-                            <td>Varies</td>
-                            <td>Varies by type</td>
-                        </tr>
-                    </tbody>
-                </table>
-            </div>
-
-            <div class="section">
-                <h3>📤 Response Examples</h3>
-                
-                <div class="response-example">
-                    <strong>Immediate Response (Video Upload):</strong>
-                    <div class="code-block">
-{
-  <span class="highlight">"success"</span>: <span class="string">true</span>,
-  <span class="highlight">"message"</span>: <span class="string">"Upload received, processing in background"</span>,
-  <span class="highlight">"upload_id"</span>: <span class="string">"xyz789abc123"</span>,
-  <span class="highlight">"files"</span>: [{
-    <span class="highlight">"filename"</span>: <span class="string">"video.mp4"</span>,
-    <span class="highlight">"size_mb"</span>: 150.5,
-    <span class="highlight">"type"</span>: <span class="string">"video"</span>,
-    <span class="highlight">"will_compress"</span>: <span class="string">true</span>,
-    <span class="highlight">"status"</span>: <span class="string">"processing"</span>
-  }],
-  <span class="highlight">"check_status_url"</span>: <span class="string">"/api/status/xyz789abc123"</span>
-}
-                    </div>
-                </div>
-
-                <div class="response-example">
-                    <strong>Status Check (After Processing):</strong>
-                    <div class="code-block">
-{
-  <span class="highlight">"status"</span>: <span class="string">"completed"</span>,
-  <span class="highlight">"original_size_mb"</span>: 150.5,
-  <span class="highlight">"final_size_mb"</span>: 75.2,
-  <span class="highlight">"savings_percent"</span>: 50.0,
-  <span class="highlight">"compressed"</span>: <span class="string">true</span>,
-  <span class="highlight">"compression_method"</span>: <span class="string">"video_h264"</span>,
-  <span class="highlight">"file_type"</span>: <span class="string">"video"</span>,
-  <span class="highlight">"filepath"</span>: <span class="string">"/full/path/to/video.mp4"</span>,
-  <span class="highlight">"filename"</span>: <span class="string">"video.mp4"</span>
-}
-                    </div>
-                </div>
-            </div>
-
-            <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; border-radius: 15px; text-align: center; margin-top: 40px;">
-                <h2 style="margin-bottom: 15px;">🚀 Ready to Upload Media?</h2>
-                <p style="margin-bottom: 20px; opacity: 0.95;">
-                    Upload images and videos with automatic compression!
-                </p>
-                <div class="code-block" style="text-align: left; background: rgba(0,0,0,0.3);">
-<span class="comment"># 1. Install FFmpeg (for video compression)</span>
-sudo apt install ffmpeg  <span class="comment"># Linux</span>
-brew install ffmpeg      <span class="comment"># Mac</span>
-
-<span class="comment"># 2. Start server</span>
-python app.py
-
-<span class="comment"># 3. Test with Postman</span>
-POST http://localhost:5009/api/smart-upload
-                </div>
-            </div>
-        </div>
-    </body>
-    </html>
-    '''
-    return render_template_string(html)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body, etag, headers = INDEX_HTML_GZ, INDEX_HTML_ETAG + '-gz', {'Content-Encoding': 'gzip'}
+    else:
+        body, etag, headers = INDEX_HTML, INDEX_HTML_ETAG, {}
+    headers.update({'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept-Encoding', 'ETag': f'"{etag}"'})
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='text/html', headers=headers)
 
 @app.route('/api/smart-upload', methods=['POST'])
 def smart_upload():
@@ -746,121 +825,170 @@ def smart_upload():
         files = request.files.getlist('files') if 'files' in request.files else []
         if 'file' in request.files:
             files.append(request.files['file'])
+        files = [file for file in files if file.filename]
         
         if not files:
-            return jsonify({'success': False, 'error': 'No files provided'}), 400
+            return json_response({'success': False, 'error': 'No files provided'}), 400
+        
+        if len(files) > MAX_PENDING_TASKS:
+            return json_response({
+                'success': False,
+                'error': f'Too many files in one upload (max {MAX_PENDING_TASKS}), split the batch'
+            }), 413
         
         # Get parameters
         should_compress = request.form.get('compress', 'true').lower() == 'true'
         quality = int(request.form.get('quality', 75))
-        video_quality = request.form.get('video_quality', 'medium')  # low, medium, high
+        video_quality = request.form.get('video_quality', 'medium')  # low, medium, high, auto
         max_dimension = int(request.form.get('max_dimension', 1920))
         event_name = request.form.get('event_name', 'uploads')
         
-        # Generate unique upload ID for tracking
-        upload_id = hashlib.md5(f"{datetime.now()}{len(files)}".encode()).hexdigest()[:12]
+        # Generate unique upload ID for tracking (random, so concurrent requests can't collide)
+        upload_id = secrets.token_hex(6)
+        
+        # One clock read per request: the event folder and every filename share it
+        received_at = datetime.now()
+        timestamp = received_at.strftime('%H%M%S_%f')
         
         # Create event folder
         event_folder = os.path.join(
             app.config['UPLOAD_FOLDER'],
             secure_filename(event_name),
-            datetime.now().strftime('%Y%m%d_%H%M%S')
+            received_at.strftime('%Y%m%d_%H%M%S')
         )
-        os.makedirs(event_folder, exist_ok=True)
+        ensure_dir(event_folder)
+        
+        # Reserve a slot for every file up front: the batch is admitted whole or rejected
+        # with 503 before any data is copied, instead of buffering without bound
+        for reserved in range(len(files)):
+            if not pending_tasks.acquire(blocking=False):
+                for _ in range(reserved):
+                    pending_tasks.release()
+                return json_response({'success': False, 'error': 'Server busy, try again shortly'}), 503
         
         file_infos = []
+        tasks = []
+        task_keys = []
+        linked = []
+        spool_paths = []
         
-        # Process each file
-        for file in files:
-            if not file.filename:
-                continue
-            
-            # Read file into memory (fast!)
-            file_data = file.read()
-            file_size = len(file_data)
-            
-            # Generate filename
-            timestamp = datetime.now().strftime('%H%M%S_%f')
-            filename = f"{timestamp}_{secure_filename(file.filename)}"
-            filepath = os.path.join(event_folder, filename)
-            
-            # Detect file type
-            mime_type = file.content_type or mimetypes.guess_type(file.filename)[0] or ''
-            is_image = mime_type.startswith('image/')
-            is_video = mime_type.startswith('video/')
-            
-            file_type = 'image' if is_image else ('video' if is_video else 'other')
-            will_compress = (is_image or is_video) and should_compress
-            
-            # Queue for background processing
-            processing_queue.put((
-                upload_id,
-                file_data,
-                filepath,
-                will_compress,
-                quality,
-                max_dimension,
-                file.filename,
-                video_quality
-            ))
-            
-            file_infos.append({
-                'filename': filename,
-                'original_name': file.filename,
-                'size_mb': round(file_size / (1024 * 1024), 2),
-                'type': file_type,
-                'will_compress': will_compress,
-                'compression_type': 'jpeg' if is_image else ('h264' if is_video else 'none'),
-                'status': 'processing',
-                'path': filepath
-            })
+        # Until the batch is handed off, a failure (e.g. ENOSPC while spooling) must give back
+        # every reserved slot and remove the spool files written so far
+        try:
+            # Process each file
+            for i, file in enumerate(files):
+                # Generate filename (the index keeps names unique within the batch)
+                filename = f"{timestamp}_{i:04d}_{secure_filename(file.filename)}"
+                filepath = os.path.join(event_folder, filename)
+                
+                # Stream to disk once; workers open the spool file instead of receiving the bytes
+                spool_path = spool_path_for(filepath)
+                spool_paths.append(spool_path)
+                file_size, digest = spool_upload(file.stream, spool_path)
+                
+                # Detect file type
+                file_type, compression_type = classify_file(file.content_type, os.path.splitext(file.filename)[1].lower())
+                will_compress = file_type != 'other' and should_compress
+                
+                # Header-only check: a JPEG that already meets the targets skips decode/encode entirely
+                if will_compress and file_type == 'image' and jpeg_meets_targets(spool_path, file_size, quality, max_dimension):
+                    will_compress = False
+                
+                # Identical content with identical settings reuses the earlier output
+                cache_key = (digest, file_type, will_compress, quality, max_dimension, video_quality)
+                cached = cached_output(cache_key)
+                linked_result = link_cached_output(cached, filepath) if cached else None
+                if linked_result:
+                    image_worker.discard_spool(spool_path)
+                    linked.append(((upload_id, filename), cache_key, linked_result))
+                else:
+                    tasks.append((
+                        spool_path,
+                        file_size,
+                        filepath,
+                        file_type,
+                        will_compress,
+                        quality,
+                        max_dimension,
+                        file.filename,
+                        video_quality
+                    ))
+                    task_keys.append(((upload_id, filename), cache_key))
+                
+                file_infos.append({
+                    'filename': filename,
+                    'original_name': file.filename,
+                    'size_mb': round(file_size / (1024 * 1024), 2),
+                    'type': file_type,
+                    'will_compress': will_compress,
+                    'compression_type': compression_type,
+                    'status': 'processing',
+                    'path': filepath
+                })
+        except Exception:
+            for _ in files:
+                pending_tasks.release()
+            for spool_path in spool_paths:
+                image_worker.discard_spool(spool_path)
+            raise
         
-        # Wait for processing to complete (synchronous mode for simple response)
-        processing_queue.join()  # Wait for all tasks to complete
+        results_store.register(upload_id, [info['filename'] for info in file_infos])
         
-        # Get result
-        result = results_store.get(upload_id, {})
+        for key, cache_key, result in linked:
+            future = Future()
+            future.set_result(result)
+            future.add_done_callback(partial(store_result, key, cache_key))
         
-        if result.get('status') == 'completed':
-            return jsonify({
-                'success': True,
-                'original_size_mb': result.get('original_size_mb'),
-                'compressed_size_mb': result.get('final_size_mb'),
-                'compressed_path': result.get('filepath'),
-                'filename': result.get('filename'),
-                'type': result.get('file_type')
-            }), 200
-        else:
-            return jsonify({
-                'success': False,
-                'error': result.get('error', 'Processing failed')
-            }), 500
+        # Submit the whole batch at once: videos go to the FFmpeg event loop, everything else to the worker pool
+        for future, (key, cache_key) in zip(submit_tasks(tasks), task_keys):
+            future.add_done_callback(partial(store_result, key, cache_key))
+        
+        # Respond as soon as the work is queued; clients poll check_status_url for results
+        return json_response({
+            'success': True,
+            'message': 'Upload received, processing in background',
+            'upload_id': upload_id,
+            'files': file_infos,
+            'check_status_url': f'/api/status/{upload_id}'
+        }), 202
         
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/status/<upload_id>', methods=['GET'])
 def check_status(upload_id):
-    """Check processing status of an upload"""
-    if upload_id in results_store:
-        return jsonify(results_store[upload_id]), 200
-    else:
-        return jsonify({
+    """Check processing status of an upload, file by file"""
+    files = results_store.get_upload(upload_id)
+    if files is None:
+        return json_response({
             'status': 'processing',
             'message': 'Still processing, check again in a moment'
         }), 200
+    
+    statuses = {f['status'] for f in files}
+    if 'processing' in statuses:
+        status = 'processing'
+    elif 'failed' in statuses:
+        status = 'failed'
+    else:
+        status = 'completed'
+    return json_response({'status': status, 'upload_id': upload_id, 'files': files}), 200
 
 @app.route('/api/download/<path:filepath>')
 def download_file(filepath):
-    """Download uploaded file"""
+    """Download uploaded file (ETag/Last-Modified, so repeat downloads get 304)"""
     try:
-        full_path = os.path.join(app.config['UPLOAD_FOLDER'], filepath)
-        if os.path.exists(full_path):
-            return send_file(full_path, as_attachment=True)
-        else:
-            return jsonify({'error': 'File not found'}), 404
+        return send_from_directory(
+            os.path.abspath(app.config['UPLOAD_FOLDER']),
+            filepath,
+            as_attachment=True,
+            conditional=True,
+            etag=True
+        )
+    except NotFound:
+        return json_response({'error': 'File not found'}), 404
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}), 500
 
 if __name__ == '__main__':
     print("=" * 70)
@@ -874,7 +1002,7 @@ if __name__ == '__main__':
     print("   📸 Image compression (JPEG, 60-75% smaller)")
     print("   🎬 Video compression (H.264, 40-70% smaller)")
     print("   📦 Batch upload (mix images + videos)")
-    print("   🔄 Background processing (4 workers)")
+    print(f"   🔄 Background processing ({NUM_WORKERS} workers)")
     print("")
     print("🎯 MAIN ENDPOINT:")
     print("   POST /api/smart-upload")
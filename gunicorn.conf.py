@@ -0,0 +1,17 @@
+"""
+Gunicorn settings for the upload API
+One gevent worker serves uploads and status polls as greenlets, so thousands of
+slow clients cost no OS threads. It stays a single worker because upload status
+lives in that process's memory; compression runs in its process pool and FFmpeg.
+"""
+
+bind = '0.0.0.0:5009'
+
+# gunicorn's gevent worker monkey-patches the stdlib before app.py is imported
+worker_class = 'gevent'
+workers = 1
+worker_connections = 1000
+
+# Large uploads over slow links: allow long requests, keep connections open for status polls
+timeout = 300
+keepalive = 30
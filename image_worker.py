@@ -0,0 +1,201 @@
+"""
+Image side of the upload pipeline: everything the compression worker processes run
+Spawned pool workers import only this module, so it must stay free of import-time
+side effects (no threads, subprocesses, file reads or prints at module level)
+"""
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image, features
+
+import turbojpeg_backend
+
+# JPEG encode speed depends on Pillow being linked against libjpeg-turbo (SIMD)
+JPEG_TURBO = features.check_feature('libjpeg_turbo')
+try:
+    JPEG_MOZJPEG = features.check_feature('mozjpeg')
+except ValueError:  # Pillow builds that predate the mozjpeg feature flag
+    JPEG_MOZJPEG = False
+
+# MozJPEG trellis-quantises by itself; elsewhere skip the second Huffman-optimisation pass
+if JPEG_MOZJPEG:
+    JPEG_SAVE_OPTIONS = {'progressive': True, 'subsampling': '4:2:0'}
+else:
+    JPEG_SAVE_OPTIONS = {'optimize': False, 'subsampling': '4:2:0'}
+
+# Rows per tile when flattening alpha, keeps each working set cache-resident
+ALPHA_TILE_ROWS = 1024
+
+def flatten_alpha(img):
+    """Composite an RGBA image onto white with vectorised NumPy math (no temporary background image)"""
+    rgba = np.asarray(img)
+    rgb = np.empty(rgba.shape[:2] + (3,), dtype=np.uint8)
+    for top in range(0, rgba.shape[0], ALPHA_TILE_ROWS):
+        tile = rgba[top:top + ALPHA_TILE_ROWS]
+        alpha = tile[..., 3:4].astype(np.uint16)
+        # (color * a + white * (255 - a)) / 255, exact rounded division in 16-bit lanes
+        mixed = tile[..., :3] * alpha + 255 * (255 - alpha) + 128
+        rgb[top:top + ALPHA_TILE_ROWS] = (mixed + (mixed >> 8)) >> 8
+    return Image.fromarray(rgb, 'RGB')
+
+def compress_image(file_data, quality, max_dimension):
+    """Re-encode an image as a resized JPEG, returns the JPEG data (bytes-like)"""
+    img = None
+    
+    # JPEG inputs decode through TurboJPEG when libturbojpeg is installed, downscaled in the IDCT
+    if turbojpeg_backend.AVAILABLE and turbojpeg_backend.is_jpeg(file_data):
+        pixels = turbojpeg_backend.decode(file_data, max_dimension)
+        if pixels is not None:
+            img = Image.fromarray(pixels)
+    
+    if img is None:
+        img = Image.open(io.BytesIO(file_data))
+        
+        # Let libjpeg downscale during decode (1/2, 1/4, 1/8 IDCT) instead of decoding full size
+        if img.format == 'JPEG':
+            img.draft('RGB', (max_dimension, max_dimension))
+        
+        # Convert to RGB if needed
+        if img.mode == 'RGBA':
+            img = flatten_alpha(img)
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+    
+    # Resize if needed
+    width, height = img.size
+    if width > max_dimension or height > max_dimension:
+        if width > height:
+            new_height = int((height / width) * max_dimension)
+            new_width = max_dimension
+        else:
+            new_width = int((width / height) * max_dimension)
+            new_height = max_dimension
+        # Big reductions box-reduce first and finish with LANCZOS; small ones don't need a 6-tap filter
+        scale = max(width, height) / max_dimension
+        if scale > 2.0:
+            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        elif scale <= 1.3:
+            img = img.resize((new_width, new_height), Image.Resampling.BILINEAR)
+        else:
+            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    
+    # Compress
+    if turbojpeg_backend.AVAILABLE:
+        encoded = turbojpeg_backend.encode(np.asarray(img), quality)
+        if encoded is not None:
+            return encoded
+    
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality, **JPEG_SAVE_OPTIONS)
+    # Hand back the BytesIO's own buffer: write_all sends it in one write() without copying it first
+    return output.getbuffer()
+
+# Final files are written unbuffered, 4 MB per syscall, straight from the source buffer
+WRITE_CHUNK_SIZE = 4 << 20
+
+def write_all(path, data):
+    """Write a bytes-like object with raw os.write calls (no Python/libc buffering)"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        with memoryview(data) as view:
+            offset = 0
+            while offset < len(view):
+                offset += os.write(fd, view[offset:offset + WRITE_CHUNK_SIZE])
+        # Nothing re-reads the file soon (downloads come later), so let the kernel evict it
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def completed_result(filepath, file_type, original_size, final_size, compressed, compression_method):
+    """Result record for a finished task"""
+    return {
+        'status': 'completed',
+        'original_size': original_size,
+        'final_size': final_size,
+        'compressed': compressed,
+        'compression_method': compression_method,
+        'file_type': file_type,
+        'filepath': os.path.abspath(filepath)
+    }
+
+def set_process_niceness():
+    """Pool initializer: run compression below the web server's priority"""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+# One reusable read buffer per image worker thread; it grows to the largest file seen
+# and is kept, unless a file pushed it past the hard cap, in which case it is dropped
+THREAD_BUFFER_MAX = 64 << 20
+thread_buffers = threading.local()
+
+def thread_buffer(size):
+    """This thread's reusable bytearray, grown to at least size bytes"""
+    buffer = getattr(thread_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(size)
+        thread_buffers.buffer = buffer
+    return buffer
+
+def trim_thread_buffer():
+    """Drop a buffer grown past the hard cap so one huge file doesn't pin its memory"""
+    buffer = getattr(thread_buffers, 'buffer', None)
+    if buffer is not None and len(buffer) > THREAD_BUFFER_MAX:
+        thread_buffers.buffer = None
+
+def read_spool(spool_path, size):
+    """Read a spool file into this thread's reusable buffer, returns a memoryview of the data"""
+    view = memoryview(thread_buffer(size))[:size]
+    offset = 0
+    with open(spool_path, 'rb', buffering=0) as f:
+        while offset < size:
+            n = f.readinto(view[offset:])
+            if not n:
+                break
+            offset += n
+    return view[:offset]
+
+def discard_spool(spool_path):
+    """Remove a spool file if it is still there"""
+    try:
+        os.unlink(spool_path)
+    except FileNotFoundError:
+        pass
+
+def process_task(task):
+    """Compress and save one image (or store any other file), runs in a worker process"""
+    spool_path, file_size, filepath, file_type, should_compress, quality, max_dimension, original_filename, video_quality = task
+    if file_type == 'image' and should_compress:
+        try:
+            try:
+                jpeg_data = compress_image(read_spool(spool_path, file_size), quality, max_dimension)
+            finally:
+                trim_thread_buffer()
+            write_all(filepath, jpeg_data)
+            discard_spool(spool_path)
+            return completed_result(filepath, file_type, file_size, len(jpeg_data), True, 'image_jpeg')
+        except Exception as e:
+            print(f"Image compression failed, using original: {e}")
+    
+    return store_original(task)
+
+def store_original(task):
+    """
+    Store an upload as-is: the spool file is renamed into place, no copy
+    Also used by the web process for tasks the worker pool couldn't run
+    """
+    spool_path, file_size, filepath, file_type = task[:4]
+    try:
+        os.replace(spool_path, filepath)
+        return completed_result(filepath, file_type, file_size, file_size, False, 'none')
+    except Exception as e:
+        return {
+            'status': 'failed',
+            'error': str(e)
+        }
+    finally:
+        discard_spool(spool_path)
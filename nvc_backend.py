@@ -0,0 +1,51 @@
+"""
+GPU video transcode backend using PyNvVideoCodec (NVDEC -> NVENC)
+Decoded surfaces stay in GPU memory and go straight into the encoder;
+the caller encodes the audio track and muxes the final MP4 with FFmpeg
+"""
+
+try:
+    import PyNvVideoCodec as nvc
+    AVAILABLE = True
+except ImportError:
+    nvc = None
+    AVAILABLE = False
+
+
+def transcode(input_path, cq, video_path):
+    """
+    Transcode a video file's video stream to a raw H.264 elementary stream at video_path, entirely on the GPU
+    Returns the source frame rate (needed to mux the stream) on success, or None
+    """
+    try:
+        # NVDEC decode into device memory
+        demuxer = nvc.CreateDemuxer(filename=input_path)
+        decoder = nvc.CreateDecoder(
+            gpuid=0,
+            codec=demuxer.GetNvCodecId(),
+            cudacontext=0,
+            cudastream=0,
+            usedevicememory=True
+        )
+        
+        # NVENC encode straight from the decoded GPU surfaces (no host copy)
+        encoder = nvc.CreateEncoder(
+            demuxer.Width(), demuxer.Height(), 'NV12', False,
+            codec='h264',
+            preset='P3',
+            tuning_info='high_quality',
+            rc='vbr',
+            cq=str(cq),
+            fps=str(round(demuxer.FrameRate()))
+        )
+        
+        with open(video_path, 'wb') as video_out:
+            for packet in demuxer:
+                for frame in decoder.Decode(packet):
+                    video_out.write(bytearray(encoder.Encode(frame)))
+            video_out.write(bytearray(encoder.EndEncode()))
+        return demuxer.FrameRate()
+    
+    except Exception as e:
+        print(f"NVC transcode error: {e}")
+        return None
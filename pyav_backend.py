@@ -0,0 +1,51 @@
+"""
+In-process video transcode backend using PyAV (libavformat/libavcodec bindings)
+Decodes and encodes with libx264 without forking FFmpeg
+"""
+
+try:
+    import av
+    AVAILABLE = True
+except ImportError:
+    av = None
+    AVAILABLE = False
+
+
+def transcode(input_path, crf, preset, output_path):
+    """
+    Transcode a video file to H.264/AAC MP4 in-process, writing output_path
+    Returns True on success
+    """
+    try:
+        with av.open(input_path) as in_container, \
+                av.open(output_path, 'w', format='mp4', options={'movflags': '+faststart'}) as out_container:
+            in_video = in_container.streams.video[0]
+            in_video.thread_type = 'AUTO'
+            
+            out_video = out_container.add_stream('libx264', rate=in_video.average_rate)
+            out_video.width = in_video.codec_context.width
+            out_video.height = in_video.codec_context.height
+            out_video.pix_fmt = 'yuv420p'
+            out_video.options = {'preset': preset, 'crf': crf}
+            
+            in_audio = in_container.streams.audio[0] if in_container.streams.audio else None
+            out_audio = None
+            if in_audio:
+                out_audio = out_container.add_stream('aac', rate=in_audio.rate)
+                out_audio.bit_rate = 96000
+            
+            # Frames go decoder -> encoder without leaving libav's buffers
+            for packet in in_container.demux(*[s for s in (in_video, in_audio) if s]):
+                out_stream = out_video if packet.stream is in_video else out_audio
+                for frame in packet.decode():
+                    out_container.mux(out_stream.encode(frame))
+            
+            # Flush encoders
+            out_container.mux(out_video.encode(None))
+            if out_audio:
+                out_container.mux(out_audio.encode(None))
+        return True
+    
+    except Exception as e:
+        print(f"PyAV transcode error: {e}")
+        return False
@@ -0,0 +1,82 @@
+"""
+JPEG codec backend using libjpeg-turbo's TurboJPEG API (PyTurboJPEG)
+Decode and encode go straight to the SIMD kernels instead of through Pillow;
+each worker process creates its own TurboJPEG handle on first use
+"""
+import numpy as np
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+JPEG_SOI = b'\xff\xd8\xff'
+
+# IDCT downscales tried when decoding, smallest output first
+DECODE_SCALES = ((1, 8), (1, 4), (1, 2))
+
+_handle = None
+
+
+def get_handle():
+    """Return this process's TurboJPEG handle, or None when libturbojpeg can't be loaded"""
+    global _handle, AVAILABLE
+    if _handle is None and AVAILABLE:
+        try:
+            _handle = TurboJPEG()
+        except (OSError, RuntimeError) as e:
+            print(f"TurboJPEG unavailable: {e}")
+            AVAILABLE = False
+    return _handle
+
+
+def is_jpeg(data):
+    """True if the buffer starts with a JPEG start-of-image marker"""
+    return bytes(data[:3]) == JPEG_SOI
+
+
+def pick_scaling_factor(tj, width, height, max_dimension):
+    """Smallest supported IDCT scale that still leaves the long side >= max_dimension, or None"""
+    long_side = max(width, height)
+    for num, denom in DECODE_SCALES:
+        if (num, denom) in tj.scaling_factors and -(-long_side * num // denom) >= max_dimension:
+            return (num, denom)
+    return None
+
+
+def decode(jpeg_data, max_dimension=None):
+    """
+    Decode JPEG data to an RGB array, or a greyscale (h, w) array for greyscale JPEGs
+    With max_dimension, libjpeg-turbo downsamples during the IDCT (1/2, 1/4, 1/8)
+    so large sources never exist at full resolution; the caller finishes the resize
+    Returns None if TurboJPEG is unavailable or can't read the data
+    """
+    tj = get_handle()
+    if tj is None:
+        return None
+    try:
+        width, height, subsample, _ = tj.decode_header(jpeg_data)
+        scaling_factor = None
+        if max_dimension:
+            scaling_factor = pick_scaling_factor(tj, width, height, max_dimension)
+        if subsample == TJSAMP_GRAY:
+            pixels = tj.decode(jpeg_data, pixel_format=TJPF_GRAY, scaling_factor=scaling_factor)
+            return pixels.reshape(pixels.shape[:2])
+        return tj.decode(jpeg_data, pixel_format=TJPF_RGB, scaling_factor=scaling_factor)
+    except OSError:
+        return None
+
+
+def encode(pixels, quality):
+    """
+    Encode an RGB (h, w, 3) or greyscale (h, w) uint8 array as JPEG bytes
+    Returns None if TurboJPEG is unavailable
+    """
+    tj = get_handle()
+    if tj is None:
+        return None
+    pixels = np.ascontiguousarray(pixels)
+    if pixels.ndim == 2:
+        return tj.encode(pixels, quality=quality, pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+    return tj.encode(pixels, quality=quality, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)